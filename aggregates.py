@@ -0,0 +1,138 @@
+"""
+Mergeable partial aggregates.
+
+A partial holds the sum, count, min and max of the non-null metric values
+of one slice of the data. Partials from any number of slices merge into one,
+from which every aggregation parse_question can ask for is finalized
+(mean is sum / count).
+
+Float sums are taken per block of BLOCK_ROWS dataset rows (with np.sum's
+pairwise summation) and the block totals added in block order. Parallel
+shards are aligned to blocks, so serial and parallel execution add exactly
+the same numbers in the same order and return the same bits.
+"""
+import numpy as np
+import pandas as pd
+
+BLOCK_ROWS = 1 << 14
+
+
+def _block_sums(values, positions):
+    """{block: float sum} of values, given the dataset row position of each."""
+    if positions is None:
+        # No row positions (out-of-core batches): one running block
+        return {0: float(values.sum())}
+
+    blocks = positions // BLOCK_ROWS
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(blocks)) + 1])
+    totals = np.add.reduceat(values, starts)
+    return dict(zip(blocks[starts].tolist(), totals.tolist()))
+
+
+def _add_sums(a, b):
+    if not isinstance(a, dict):
+        return a + b
+    merged = dict(a)
+    for block, total in b.items():
+        merged[block] = merged[block] + total if block in merged else total
+    return merged
+
+
+def mergeable_dtype(dtype):
+    """Whether partial aggregates can represent a metric of this dtype exactly."""
+    if not isinstance(dtype, np.dtype):
+        # Nullable extension dtypes (Int64, Float64...) expose their numpy type
+        dtype = getattr(dtype, "numpy_dtype", None)
+    return dtype is not None and dtype.kind in "iuf"
+
+
+def metric_arrays(series):
+    """
+    ``(values, valid)`` numpy arrays of a metric column for partial_aggregate.
+
+    ``valid`` masks out the missing values of nullable dtypes, and is None
+    when the values need no mask (numpy floats carry NaN instead).
+    """
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype):
+        return series.to_numpy(), None
+
+    numpy_dtype = dtype.numpy_dtype
+    valid = series.notna().to_numpy()
+    na_value = np.nan if numpy_dtype.kind == "f" else 0
+    return series.to_numpy(dtype=numpy_dtype, na_value=na_value), valid
+
+
+def partial_aggregate(values, valid=None, positions=None):
+    """
+    Partial aggregate of a 1-d numpy array of already-filtered metric values.
+
+    ``positions`` are the values' row positions in the dataset (ascending);
+    they decide the blocks float sums are split into.
+    """
+    if valid is not None:
+        values = values[valid]
+        positions = None if positions is None else positions[valid]
+
+    is_float = values.dtype.kind == "f"
+    if is_float:
+        present = ~np.isnan(values)
+        values = values[present]
+        positions = None if positions is None else positions[present]
+
+    if len(values) == 0:
+        zero = {} if is_float else values.dtype.type(0)
+        return {"sum": zero, "count": 0, "min": None, "max": None}
+
+    return {
+        "sum": _block_sums(values, positions) if is_float else values.sum(),
+        "count": len(values),
+        "min": values.min(),
+        "max": values.max(),
+    }
+
+
+def merge_partials(partials):
+    merged = None
+
+    for p in partials:
+        if merged is None:
+            merged = dict(p)
+            continue
+
+        merged["sum"] = _add_sums(merged["sum"], p["sum"])
+        merged["count"] += p["count"]
+        if p["min"] is not None:
+            merged["min"] = p["min"] if merged["min"] is None else min(merged["min"], p["min"])
+        if p["max"] is not None:
+            merged["max"] = p["max"] if merged["max"] is None else max(merged["max"], p["max"])
+
+    if merged is None:
+        # Nothing survived the filters (e.g. every row group was pruned)
+        return {"sum": 0, "count": 0, "min": None, "max": None}
+
+    return merged
+
+
+def finalize(aggregation, partial):
+    total = partial["sum"]
+    if isinstance(total, dict):
+        # Block totals in block order, whichever partials they came from
+        total = np.add.reduce(np.array([total[b] for b in sorted(total)], dtype=np.float64))
+
+    if aggregation == "sum":
+        return total
+    if aggregation == "count":
+        return partial["count"]
+    if aggregation == "mean":
+        return total / partial["count"] if partial["count"] else np.nan
+    if aggregation in ("min", "max"):
+        return np.nan if partial[aggregation] is None else partial[aggregation]
+    raise ValueError(f"Unsupported aggregation: {aggregation}")
+
+
+def result_frame(parsed, partial):
+    """Shape a merged partial like SmartAnalyticsEngine.execute_query does."""
+    agg_func = parsed["aggregation"]
+    value = finalize(agg_func, partial)
+    return pd.DataFrame({f"{agg_func}_{parsed['metric']}": [value]})
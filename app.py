@@ -1,11 +1,24 @@
 import streamlit as st
 import pandas as pd
-from engine import run_query, SmartAnalyticsEngine, ask_ai          
+from engine import SmartAnalyticsEngine, ask_ai, load_table, coerce_date_columns, apply_filters
+from tracing import start_trace, stage
+from approx import progressive_query, describe, prepare_sample
+from result_cache import ResultCache, cached_query
 import base64
 import io
+import uuid
 
 st.set_page_config(page_title="Smart Analytics Engine", layout="wide")
 
+# One trace per rerun; shown in the performance panel, and appended to the
+# trace log when it asked a question. Memory tracking is set per process
+# (TRACE_MEMORY=1), not per session.
+show_perf_panel = st.sidebar.checkbox("Show performance panel")
+
+trace = start_trace(source="streamlit")
+
+# Static assets are built once per process, not on every rerun
+@st.cache_resource
 def get_base64(bin_file):
     try:
         with open(bin_file, 'rb') as f:
@@ -14,10 +27,11 @@ def get_base64(bin_file):
     except FileNotFoundError:
         return "" # Fallback if image isn't found
 
-bg_img = get_base64("background.jpeg")
+@st.cache_resource
+def get_page_style():
+    bg_img = get_base64("background.jpeg")
 
-# Inject Custom CSS to match the new screenshots
-st.markdown(f"""
+    return f"""
 <style>
     /* Main Background & Base Text */
     .stApp {{
@@ -156,7 +170,10 @@ st.markdown(f"""
         border: none;
     }}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Inject Custom CSS to match the new screenshots
+st.markdown(get_page_style(), unsafe_allow_html=True)
 
 st.title("📊 Smart Analytics Engine")
 
@@ -184,6 +201,13 @@ def build_manual_relationship(dfs_dict):
     base_table = st.selectbox("Select Base Table", table_names)
     merged_df = dfs_dict[base_table]
 
+    # Each join step is memoized on its selections and input frames, so reruns
+    # return the same merged DataFrame (and keep the session engine built on it)
+    join_cache = st.session_state.get('join_cache', {})
+    used_steps = {}
+    step = (base_table,)
+    sources = (merged_df,)
+
     remaining_tables = [t for t in table_names if t != base_table]
 
     for tbl in remaining_tables:
@@ -212,6 +236,15 @@ def build_manual_relationship(dfs_dict):
                     key=f"type_{tbl}"
                 )
 
+                step += ((tbl, left_col, right_col, join_type),)
+                sources += (dfs_dict[tbl],)
+                cached = join_cache.get(step)
+
+                if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+                    merged_df = cached[1]
+                    used_steps[step] = cached
+                    continue
+
                 try:
                     merged_df = merged_df.merge(
                         dfs_dict[tbl],
@@ -219,11 +252,49 @@ def build_manual_relationship(dfs_dict):
                         right_on=right_col,
                         how=join_type
                     )
+                    used_steps[step] = (sources, merged_df)
                 except Exception as e:
                     st.error(f"Join failed: {e}")
 
+    # Only the current chain of joins is kept
+    st.session_state['join_cache'] = used_steps
     return merged_df
 
+# =========================================================
+# QUERY ENGINE & RESULT CACHE
+# =========================================================
+@st.cache_resource
+def get_result_cache():
+    # Shared by every session; results are keyed by the dataset's content
+    return ResultCache()
+
+def get_session_engine(df):
+    """Reuse the session's engine (and its samples) while its DataFrame is unchanged."""
+    engine = st.session_state.get('engine')
+    if engine is not None and st.session_state.get('engine_df') is df:
+        return engine
+
+    # A new DataFrame means a re-upload, join change or append. Hashing its
+    # contents would cost more than a query, so results are keyed by a
+    # version token instead, and the old version's results are dropped
+    new_engine = SmartAnalyticsEngine(df, version=uuid.uuid4().hex)
+
+    if engine is not None:
+        get_result_cache().invalidate(engine.fingerprint(compute=False))
+
+    st.session_state['engine'] = new_engine
+    st.session_state['engine_df'] = df
+    return new_engine
+
+# =========================================================
+# DATABASE CONNECTIONS
+# =========================================================
+@st.cache_resource
+def get_db_engine(db_uri):
+    # sqlalchemy is only imported once someone connects to a database
+    import sqlalchemy as sa
+    return sa.create_engine(db_uri)
+
 # =========================================================
 # MULTIPLE FILE UPLOAD
 # =========================================================
@@ -238,16 +309,26 @@ if data_source_opt == "Upload Excel File(s)":
 
     if uploaded_files:
 
-        dfs_dict = {}
+        # Parse each upload once; reruns reuse the same DataFrames
+        upload_key = tuple((getattr(file, "file_id", None), file.name, file.size) for file in uploaded_files)
 
-        for file in uploaded_files:
-            try:
-                if file.name.endswith(".csv"):
-                    dfs_dict[file.name] = pd.read_csv(file)
-                else:
-                    dfs_dict[file.name] = pd.read_excel(file)
-            except Exception as e:
-                st.error(f"Error reading {file.name}: {e}")
+        if st.session_state.get('upload_key') != upload_key:
+            dfs_dict = {}
+            errors = []
+
+            for file in uploaded_files:
+                try:
+                    dfs_dict[file.name] = load_table(file)
+                except Exception as e:
+                    errors.append(f"Error reading {file.name}: {e}")
+
+            st.session_state['upload_key'] = upload_key
+            st.session_state['uploaded_dfs'] = (dfs_dict, errors)
+            st.session_state['appended_df'] = None
+
+        dfs_dict, errors = st.session_state['uploaded_dfs']
+        for error in errors:
+            st.error(error)
 
         if len(dfs_dict) == 1:
             st.session_state['df'] = list(dfs_dict.values())[0]
@@ -260,7 +341,9 @@ if data_source_opt == "Upload Excel File(s)":
             )
 
             if combine_mode == "Append (same columns)":
-                st.session_state['df'] = pd.concat(dfs_dict.values(), ignore_index=True)
+                if st.session_state['appended_df'] is None:
+                    st.session_state['appended_df'] = pd.concat(dfs_dict.values(), ignore_index=True)
+                st.session_state['df'] = st.session_state['appended_df']
 
             else:
                 st.session_state['df'] = build_manual_relationship(dfs_dict)
@@ -284,8 +367,7 @@ elif data_source_opt == "Connect to Database":
 
     if st.button("Connect & Fetch Data") and db_uri and sql_queries:
         try:
-            import sqlalchemy as sa
-            engine = sa.create_engine(db_uri)
+            engine = get_db_engine(db_uri)
 
             dfs_dict = {}
 
@@ -317,12 +399,7 @@ df = st.session_state['df']
 if df is not None:
 
     # Auto-detect date columns
-    for col in df.columns:
-        if "date" in col.lower():
-            try:
-                df[col] = pd.to_datetime(df[col])
-            except:
-                pass
+    coerce_date_columns(df)
 
     st.success("File uploaded successfully!")
 
@@ -333,8 +410,36 @@ if df is not None:
     st.subheader("Ask AI Question")
     question = st.text_input("Type your question")
 
+    approximate = st.checkbox(
+        "⚡ Show approximate answer first",
+        help="Estimates sum/average/count from 1% and 10% samples while the exact result is computed"
+    )
+
+    if approximate:
+        # Start sampling now, while the question is being typed
+        prepare_sample(get_session_engine(df))
+
     if st.button("Run Query") and question:
-        st.session_state['query_result'] = run_query(df, question)
+        trace.meta["question"] = question
+
+        engine = get_session_engine(df)
+        parsed = engine.parse_question(question)
+
+        if approximate:
+            progress = st.empty()
+
+            # Each step replaces the previous one; the last step is the exact result
+            for step in progressive_query(engine, parsed):
+                with progress.container():
+                    summary = describe(step)
+                    if summary:
+                        st.info(summary)
+                    st.dataframe(step, use_container_width=True)
+
+            progress.empty()
+            st.session_state['query_result'] = step
+        else:
+            st.session_state['query_result'] = cached_query(engine, parsed, get_result_cache())
         
     if st.session_state['query_result'] is not None:
         st.subheader("Result")
@@ -350,24 +455,19 @@ if df is not None:
     # Dynamic filter
     st.subheader("Filter Data")
 
-    filtered_df = df.copy()
-
     # Let user pick which columns to filter on
     filter_cols = st.multiselect("Filter dataframe on", df.columns)
-    
+    selections = {}
+
     for col in filter_cols:
         # Datetime
         if pd.api.types.is_datetime64_any_dtype(df[col]):
-            target_date = st.date_input(f"Select date for {col}", value=None)
-            if target_date:
-                filtered_df = filtered_df[filtered_df[col].dt.date == target_date]
+            selections[col] = st.date_input(f"Select date for {col}", value=None)
         
         # Categorical / Object / String
         elif pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
             unique_vals = df[col].dropna().unique()
-            selected_vals = st.multiselect(f"Select values for {col}", unique_vals)
-            if selected_vals:
-                filtered_df = filtered_df[filtered_df[col].isin(selected_vals)]
+            selections[col] = st.multiselect(f"Select values for {col}", unique_vals)
                 
         # Numeric
         elif pd.api.types.is_numeric_dtype(df[col]):
@@ -376,13 +476,14 @@ if df is not None:
                 _max = float(df[col].dropna().max())
                 
                 if _min < _max:
-                    selected_range = st.slider(f"Select range for {col}", min_value=_min, max_value=_max, value=(_min, _max))
-                    filtered_df = filtered_df[(df[col] >= selected_range[0]) & (df[col] <= selected_range[1])]
+                    selections[col] = st.slider(f"Select range for {col}", min_value=_min, max_value=_max, value=(_min, _max))
                 else:
                     st.info(f"Column '{col}' has a constant value of {_min}")
             except Exception:
                 st.info(f"Could not filter numeric column '{col}'")
 
+    filtered_df = apply_filters(df, selections)
+
     st.subheader("Filtered Data")
     display_cols = st.multiselect("Choose columns to display", df.columns, default=df.columns[:5])
     if display_cols:
@@ -441,14 +542,15 @@ if df is not None:
         
         # Prepare data for plotting (aggregate if necessary depending on the chart)
         # Use streamlit native charts
-        if chart_type == "Bar Chart":
-            st.bar_chart(final_df, x=x_axis, y=y_axis)
-        elif chart_type == "Line Chart":
-            st.line_chart(final_df, x=x_axis, y=y_axis)
-        elif chart_type == "Scatter Plot":
-            st.scatter_chart(final_df, x=x_axis, y=y_axis)
-        elif chart_type == "Area Chart":
-            st.area_chart(final_df, x=x_axis, y=y_axis)
+        with stage("chart", chart_type=chart_type, rows=len(final_df)):
+            if chart_type == "Bar Chart":
+                st.bar_chart(final_df, x=x_axis, y=y_axis)
+            elif chart_type == "Line Chart":
+                st.line_chart(final_df, x=x_axis, y=y_axis)
+            elif chart_type == "Scatter Plot":
+                st.scatter_chart(final_df, x=x_axis, y=y_axis)
+            elif chart_type == "Area Chart":
+                st.area_chart(final_df, x=x_axis, y=y_axis)
             
     else:
         st.info("Need at least 2 columns in the dataset to generate a dashboard.")
@@ -461,6 +563,7 @@ if st.button("Ask AI"):
     if question:
         with st.spinner("AI analyzing your data..."):
             try:
+                trace.meta["question"] = question
                 ai_result = ask_ai(df, question)
                 st.markdown("### 🤖 AI Insights")
                 st.write(ai_result)
@@ -500,6 +603,7 @@ if df is not None:
         # AI response
         with st.spinner("Analyzing your data..."):
             try:
+                trace.meta["question"] = prompt
                 reply = ask_ai(df, prompt)
             except Exception as e:
                 reply = f"AI Error: {e}"
@@ -510,4 +614,19 @@ if df is not None:
         st.chat_message("assistant").write(reply)
 
 else:
-    st.info("Upload data to enable AI Copilot.")
\ No newline at end of file
+    st.info("Upload data to enable AI Copilot.")
+
+# =========================================================
+# ⏱️ PERFORMANCE PANEL
+# =========================================================
+trace.finish()
+
+if show_perf_panel:
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        st.metric("Total rerun time", f"{trace.total_seconds * 1000:.1f} ms")
+        if trace.stages:
+            st.dataframe(pd.DataFrame(trace.stages), use_container_width=True)
+        if trace.llm:
+            st.json(trace.llm)
+        st.caption("Result cache")
+        st.json(get_result_cache().stats())
@@ -0,0 +1,249 @@
+"""
+Approximate answers from stratified samples, with progressive refinement.
+
+Each engine keeps one StratifiedSample of its data: rows are grouped by
+stratum (the values of its lowest-cardinality text column) and a random
+subset is drawn within each stratum, so the sample for any fraction is a
+prefix of every stratum's draw and smaller samples are nested in larger
+ones. sum, count and mean are estimated with the usual stratified
+estimators and a normal-approximation confidence interval; min and max
+can't be estimated from a sample and always run exactly.
+
+Building the sample costs one pass over the data, so callers that know a
+dataset will be queried approximately start it early with prepare_sample().
+"""
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_FRACTIONS = (0.01, 0.1)
+CONFIDENCE_Z = 1.96  # 95% interval
+MAX_STRATA = 50
+ESTIMABLE_AGGREGATIONS = ("sum", "count", "mean")
+
+EXACT_LABEL = "exact"
+
+
+class StratifiedSample:
+
+    def __init__(self, engine, seed=0):
+        self.df = engine.df
+        self.strata_column = None
+
+        candidates = [
+            (len(values), col) for col, values in engine.categorical_values().items()
+            if 2 <= len(values) <= MAX_STRATA
+        ]
+        if candidates:
+            self.strata_column = min(candidates)[1]
+            codes, _ = pd.factorize(self.df[self.strata_column])
+            codes = codes + 1  # missing values (-1) become their own stratum
+        else:
+            codes = np.zeros(len(self.df), dtype=np.int64)
+
+        # Row positions grouped by stratum; a stable sort of 8-bit codes is a
+        # linear-time radix sort
+        self._order = np.argsort(codes.astype(np.int8), kind="stable")
+
+        sizes = np.bincount(codes)
+        self._starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])[sizes > 0]
+        self.strata_sizes = sizes[sizes > 0]
+
+        self._rng = np.random.default_rng(seed)
+        self._draws = None
+        self._samples = {}
+        # Query threads share the sample; draws and the cache change together
+        self._lock = threading.Lock()
+
+    def _sample_sizes(self, fraction):
+        return np.minimum(
+            self.strata_sizes,
+            np.maximum(1, np.ceil(self.strata_sizes * fraction).astype(np.int64))
+        )
+
+    def _draw(self, n_h):
+        """Random rows of each stratum, in random order, at least n_h of them."""
+        if self._draws is None:
+            # Draw for the largest default fraction up front, so those samples nest
+            n_h = np.maximum(n_h, self._sample_sizes(max(SAMPLE_FRACTIONS)))
+            self._draws = [
+                self._rng.choice(size, n, replace=False, shuffle=True)
+                for size, n in zip(self.strata_sizes, n_h)
+            ]
+
+        # Larger fractions extend each stratum's draw with a random order of
+        # rows not drawn yet, so samples already handed out stay prefixes
+        for h, (size, n) in enumerate(zip(self.strata_sizes, n_h)):
+            drawn = self._draws[h]
+            if len(drawn) < n:
+                rest = np.setdiff1d(np.arange(size), drawn, assume_unique=True)
+                extra = self._rng.choice(rest, n - len(drawn), replace=False, shuffle=True)
+                self._draws[h] = np.concatenate([drawn, extra])
+        return self._draws
+
+    def take(self, fraction):
+        """Return (sample frame, stratum of each sample row, rows sampled per stratum)."""
+        sample = self._samples.get(fraction)
+        if sample is not None:
+            return sample
+
+        with self._lock:
+            if fraction not in self._samples:
+                n_h = self._sample_sizes(fraction)
+                draws = self._draw(n_h)
+                positions = np.concatenate([
+                    self._order[start + draw[:n]] for start, draw, n in zip(self._starts, draws, n_h)
+                ])
+                frame = self.df.iloc[positions].reset_index(drop=True)
+                strata = np.repeat(np.arange(len(n_h)), n_h)
+                self._samples[fraction] = (frame, strata, n_h)
+            return self._samples[fraction]
+
+
+_sample_lock = threading.Lock()
+
+
+def get_sample(engine):
+    # Builds are rare; one lock keeps a query from building a sample that
+    # prepare_sample is already building
+    with _sample_lock:
+        sample = getattr(engine, "_stratified_sample", None)
+        if sample is None:
+            sample = engine._stratified_sample = StratifiedSample(engine)
+    return sample
+
+
+def prepare_sample(engine):
+    """
+    Build the engine's sample on a background thread, so the first
+    approximate query doesn't pay for it. Returns the thread, or None when
+    there is nothing to sample.
+    """
+    if getattr(engine, "df", None) is None or engine.rows == 0:
+        return None
+    if getattr(engine, "_stratified_sample", None) is not None:
+        return None
+
+    thread = threading.Thread(target=get_sample, args=(engine,), name="sample", daemon=True)
+    thread.start()
+    return thread
+
+
+# -----------------------------
+# ESTIMATION
+# -----------------------------
+def _stratum_stats(values, strata, n_h):
+    """Per-stratum mean and sample variance of values."""
+    means = np.bincount(strata, weights=values, minlength=len(n_h)) / n_h
+    deviations = values - means[strata]
+    sq = np.bincount(strata, weights=deviations ** 2, minlength=len(n_h))
+    variances = np.divide(sq, n_h - 1, out=np.zeros_like(sq), where=n_h > 1)
+    return means, variances
+
+
+def estimate_query(engine, parsed, fraction):
+    """
+    Estimate a sum/count/mean query from a ``fraction`` sample of the data.
+
+    Returns None when the query isn't estimable (no aggregation, min/max),
+    the dataset is empty or the fraction covers it whole, so the caller
+    runs it exactly.
+    """
+    agg_func = parsed["aggregation"]
+    if agg_func not in ESTIMABLE_AGGREGATIONS or not parsed["metric"] or fraction >= 1:
+        return None
+    if engine.rows == 0:
+        return None
+
+    sample = get_sample(engine)
+    frame, strata, n_h = sample.take(fraction)
+    N_h = sample.strata_sizes
+
+    matched = np.zeros(len(frame), dtype=bool)
+    matched[engine.filter_frame(frame, parsed).index] = True
+
+    metric = frame[parsed["metric"]].to_numpy(dtype=float, na_value=np.nan)
+    matched &= ~np.isnan(metric)
+    y = np.where(matched, metric, 0.0)
+    c = matched.astype(float)
+
+    # Weight of each stratum's sample variance in the estimator's variance
+    var_weight = N_h ** 2 * (1 - n_h / N_h) / n_h
+
+    mean_y, var_y = _stratum_stats(y, strata, n_h)
+    mean_c, var_c = _stratum_stats(c, strata, n_h)
+    total = float(np.sum(N_h * mean_y))
+    count = float(np.sum(N_h * mean_c))
+
+    if agg_func == "sum":
+        estimate, variance = total, float(np.sum(var_weight * var_y))
+    elif agg_func == "count":
+        estimate, variance = count, float(np.sum(var_weight * var_c))
+    else:
+        if count == 0:
+            estimate, variance = np.nan, np.nan
+        else:
+            # Ratio estimator, variance by linearization
+            estimate = total / count
+            _, var_d = _stratum_stats(y - estimate * c, strata, n_h)
+            variance = float(np.sum(var_weight * var_d)) / count ** 2
+
+    margin = CONFIDENCE_Z * math.sqrt(variance) if variance == variance else np.nan
+
+    return pd.DataFrame({
+        f"{agg_func}_{parsed['metric']}": [estimate],
+        "ci_low": [estimate - margin],
+        "ci_high": [estimate + margin],
+        "rel_error": [margin / abs(estimate) if estimate else np.nan],
+        "sample_rows": [len(frame)],
+        "label": [f"{fraction:.0%} sample estimate"],
+    })
+
+
+def progressive_query(engine, parsed, fractions=SAMPLE_FRACTIONS, workers=None):
+    """
+    Yield increasingly precise answers: one estimate per sample fraction,
+    then the exact result. Queries that can't be estimated yield only the
+    exact result.
+    """
+    for fraction in fractions:
+        result = engine.execute_query(parsed, workers, sample_fraction=fraction)
+        if "label" not in result.columns:
+            # Not estimable, so this already is the exact result
+            break
+        yield result
+    else:
+        result = engine.execute_query(parsed, workers)
+
+    if parsed["aggregation"] and parsed["metric"]:
+        result = result.assign(label=EXACT_LABEL)
+    yield result
+
+
+# -----------------------------
+# DISPLAY
+# -----------------------------
+def _human(value):
+    for threshold, suffix in ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(value) >= threshold:
+            return f"{value / threshold:.2f}{suffix}"
+    return f"{value:,.2f}"
+
+
+def describe(result):
+    """One-line summary of a progressive_query step, e.g. "≈ 1.24M ± 0.3%"."""
+    if "label" not in result.columns or result.empty:
+        return None
+
+    value = result.iloc[0, 0]
+    label = result["label"].iloc[0]
+    if pd.isna(value):
+        return f"no matching rows · {label}"
+    if label == EXACT_LABEL:
+        return f"{_human(value)} · {label}"
+
+    rel_error = result["rel_error"].iloc[0]
+    spread = f" ± {rel_error:.1%}" if pd.notna(rel_error) else ""
+    return f"≈ {_human(value)}{spread} · {label}"
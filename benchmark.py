@@ -0,0 +1,249 @@
+"""
+Offline benchmark suite for the analytics engine and the ingestion paths.
+
+Generates synthetic sales datasets, times each stage of the engine and the
+load/filter helpers, and compares the results with a JSON baseline.
+
+    python benchmark.py                       # compare against the baseline
+    python benchmark.py --update-baseline     # record a new baseline
+    python benchmark.py --sizes 10000 10000000 --threshold 0.2
+
+Exits with status 1 when a case is slower (or uses more peak memory) than
+the baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from engine import SmartAnalyticsEngine, run_query, load_table, coerce_date_columns, apply_filters
+from outofcore import OutOfCoreEngine
+from result_cache import ResultCache, cached_query
+
+BASELINE_PATH = "benchmark_baseline.json"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_CARDINALITIES = [10, 1_000]
+DEFAULT_DATE_SPANS = [365, 1_825]
+
+# openpyxl is far too slow to write (and xlsx too small to hold) the big sizes
+EXCEL_MAX_ROWS = 100_000
+
+
+# -----------------------------
+# SYNTHETIC DATA
+# -----------------------------
+def make_sales_dataset(rows, cardinality=10, days=365, seed=0):
+    """Build a sales-style DataFrame with a date, categoricals and metrics."""
+    rng = np.random.default_rng(seed)
+
+    regions = np.array(["North", "South", "East", "West"], dtype=object)
+    products = np.array([f"Product {i:05d}" for i in range(cardinality)], dtype=object)
+    start = np.datetime64("2022-01-01")
+
+    return pd.DataFrame({
+        "Order Date": start + rng.integers(0, days, rows).astype("timedelta64[D]"),
+        "Region": pd.Series(regions[rng.integers(0, len(regions), rows)], dtype=object),
+        "Product": pd.Series(products[rng.integers(0, cardinality, rows)], dtype=object),
+        "Sales": rng.gamma(2.0, 150.0, rows).round(2),
+        "Quantity": rng.integers(1, 20, rows),
+    })
+
+
+def make_question(df):
+    region = df["Region"].iloc[0]
+    year = int(df["Order Date"].dt.year.iloc[0])
+    return f"total Sales for {region} in march {year}"
+
+
+def make_filter_selections(df):
+    return {
+        "Order Date": df["Order Date"].dt.date.iloc[0],
+        "Product": list(df["Product"].iloc[:3]),
+        "Sales": (100.0, 500.0),
+    }
+
+
+# -----------------------------
+# MEASUREMENT
+# -----------------------------
+def measure(func, repeats):
+    """Return (best wall time in seconds, peak traced memory in MB)."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    # Separate run for memory, tracemalloc would skew the timings
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(timings), peak / 2**20
+
+
+def benchmark_cases(df, tmpdir, name):
+    """Yield (case name, callable) pairs for one dataset."""
+    question = make_question(df)
+    engine = SmartAnalyticsEngine(df)
+    parsed = engine.parse_question(question)
+    selections = make_filter_selections(df)
+
+    yield "engine_init", lambda: SmartAnalyticsEngine(df)
+    yield "parse_question", lambda: engine.parse_question(question)
+    yield "execute_query", lambda: engine.execute_query(parsed)
+    yield "execute_query_parallel", lambda: engine.execute_query(parsed, workers=os.cpu_count())
+    yield "run_query", lambda: run_query(df, question)
+    yield "fingerprint", lambda: SmartAnalyticsEngine(df).fingerprint()
+
+    cache = ResultCache()
+    cached_query(engine, parsed, cache)
+    yield "execute_query_cached", lambda: cached_query(engine, parsed, cache)
+    yield "filter_panel", lambda: apply_filters(df, selections)
+
+    csv_path = os.path.join(tmpdir, f"{name}.csv")
+    df.to_csv(csv_path, index=False)
+    yield "load_csv", lambda: coerce_date_columns(load_table(csv_path))
+
+    csv_engine = OutOfCoreEngine(csv_path)
+    yield "execute_query_out_of_core", lambda: csv_engine.execute_query(parsed)
+
+    if len(df) <= EXCEL_MAX_ROWS:
+        xlsx_path = os.path.join(tmpdir, f"{name}.xlsx")
+        df.to_excel(xlsx_path, index=False)
+        yield "load_excel", lambda: coerce_date_columns(load_table(xlsx_path))
+
+
+def startup_cases():
+    """Yield (case name, callable) pairs for cold start and Streamlit reruns."""
+    for module in ("engine", "service"):
+        # A fresh interpreter each time, so nothing is already imported
+        yield f"import_{module}", lambda module=module: subprocess.run(
+            [sys.executable, "-c", f"import {module}"], cwd=REPO_DIR, check=True
+        )
+
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=60)
+    app.run()
+    yield "app_rerun", app.run
+
+
+def run_suite(sizes, cardinalities, date_spans, repeats, startup=True):
+    results = {}
+
+    if startup:
+        for case, func in startup_cases():
+            seconds, peak_mb = measure(func, repeats)
+            results[f"startup/{case}"] = {
+                "seconds": round(seconds, 6),
+                "peak_mb": round(peak_mb, 3),
+            }
+            print(f"{'startup':<40} {case:<24} {seconds * 1000:10.2f} ms {peak_mb:10.2f} MB")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in sizes:
+            for cardinality in cardinalities:
+                for days in date_spans:
+                    name = f"rows={rows}/card={cardinality}/days={days}"
+                    df = make_sales_dataset(rows, cardinality, days)
+                    file_stem = f"{rows}_{cardinality}_{days}"
+
+                    for case, func in benchmark_cases(df, tmpdir, file_stem):
+                        seconds, peak_mb = measure(func, repeats)
+                        results[f"{name}/{case}"] = {
+                            "seconds": round(seconds, 6),
+                            "peak_mb": round(peak_mb, 3),
+                        }
+                        print(f"{name:<40} {case:<24} {seconds * 1000:10.2f} ms {peak_mb:10.2f} MB")
+
+    return results
+
+
+# -----------------------------
+# BASELINE COMPARISON
+# -----------------------------
+def compare(results, baseline, threshold, min_seconds):
+    """Return a list of human-readable regressions."""
+    regressions = []
+
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+
+        if (
+            current["seconds"] > min_seconds
+            and current["seconds"] > previous["seconds"] * (1 + threshold)
+        ):
+            regressions.append(
+                f"{key}: time {previous['seconds'] * 1000:.2f} ms -> {current['seconds'] * 1000:.2f} ms"
+            )
+
+        if current["peak_mb"] > previous["peak_mb"] * (1 + threshold) + 0.1:
+            regressions.append(
+                f"{key}: peak memory {previous['peak_mb']:.2f} MB -> {current['peak_mb']:.2f} MB"
+            )
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Smart Analytics Engine offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--cardinalities", type=int, nargs="+", default=DEFAULT_CARDINALITIES)
+    parser.add_argument("--date-spans", type=int, nargs="+", default=DEFAULT_DATE_SPANS,
+                        help="Date span of the synthetic data in days")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed relative regression before failing (0.25 = 25%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.001,
+                        help="Ignore timing regressions on cases faster than this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true",
+                        help="Don't time module imports and Streamlit reruns")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.cardinalities, args.date_spans, args.repeats,
+                        startup=not args.skip_startup)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold, args.min_seconds)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
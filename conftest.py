@@ -0,0 +1,2 @@
+# test_ai.py is a manual script that calls a live model when imported
+collect_ignore = ["test_ai.py"]
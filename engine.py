@@ -1,21 +1,24 @@
 import pandas as pd
 import calendar
 import re
-from rapidfuzz import process
-from openai import OpenAI
 import os
-from dotenv import load_dotenv
+import time
+import hashlib
+import uuid
+from functools import lru_cache
+from tracing import stage, record_llm
+from aggregates import mergeable_dtype, metric_arrays, partial_aggregate, result_frame
+from parallel import execute_parallel
+from approx import estimate_query
 
-# Load environment variables
-load_dotenv()
-
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# rapidfuzz, openai and dotenv are imported on first use to keep startup fast
 
 
 class SmartAnalyticsEngine:
 
-    def __init__(self, df):
+    def __init__(self, df, version=None):
         self.df = df.copy()
+        self.rows = len(df)
         self.columns = df.columns.tolist()
         self.lower_columns = [c.lower() for c in self.columns]
 
@@ -25,10 +28,54 @@ class SmartAnalyticsEngine:
             if pd.api.types.is_datetime64_any_dtype(df[col])
         ]
 
+        self.numeric_columns = [
+            col for col in self.columns
+            if pd.api.types.is_numeric_dtype(df[col])
+        ]
+
+        self._categorical_values = None
+        # Callers that already track when their data changes pass a version
+        # token, which stands in for the content hash
+        self._fingerprint = None if version is None else f"version:{version}"
+
+    # -----------------------------
+    # COLUMN METADATA
+    # -----------------------------
+    def fingerprint(self, compute=True):
+        """
+        Content hash of the dataset, computed once per engine (or the
+        version token the engine was created with).
+
+        With compute=False, returns None instead of hashing if it hasn't been
+        computed yet.
+        """
+        if self._fingerprint is None and compute:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(repr((self.columns, [str(t) for t in self.df.dtypes])).encode())
+            try:
+                digest.update(pd.util.hash_pandas_object(self.df, index=True).to_numpy().tobytes())
+                self._fingerprint = digest.hexdigest()
+            except TypeError:
+                # Unhashable cells (lists, dicts...): never share results with another engine
+                self._fingerprint = uuid.uuid4().hex
+        return self._fingerprint
+
+    def categorical_values(self):
+        """Distinct values of each text column, computed once per engine."""
+        if self._categorical_values is None:
+            self._categorical_values = {
+                col: self.df[col].dropna().unique()
+                for col in self.columns
+                if pd.api.types.is_object_dtype(self.df[col]) or pd.api.types.is_string_dtype(self.df[col])
+            }
+        return self._categorical_values
+
     # -----------------------------
     # SMART COLUMN MATCHING
     # -----------------------------
     def match_column(self, word):
+        from rapidfuzz import process
+
         word = word.lower()
 
         if word in self.lower_columns:
@@ -44,6 +91,10 @@ class SmartAnalyticsEngine:
     # NLP PARSER
     # -----------------------------
     def parse_question(self, question):
+        with stage("parse_question"):
+            return self._parse_question(question)
+
+    def _parse_question(self, question):
 
         question_lower = question.lower()
 
@@ -71,7 +122,7 @@ class SmartAnalyticsEngine:
 
         # Detect numeric metric
         for col in self.columns:
-            if col.lower() in question_lower and pd.api.types.is_numeric_dtype(self.df[col]):
+            if col.lower() in question_lower and col in self.numeric_columns:
                 parsed["metric"] = col
                 break
 
@@ -88,24 +139,61 @@ class SmartAnalyticsEngine:
             parsed["time_filter"]["year"] = int(year_match.group(1))
 
         # Categorical filters
-        for col in self.columns:
-            if self.df[col].dtype == "object":
-                for val in self.df[col].dropna().unique():
-                    if str(val).lower() in question_lower:
-                        parsed["filters"].append({
-                            "column": col,
-                            "value": val
-                        })
+        for col, values in self.categorical_values().items():
+            for val in values:
+                if str(val).lower() in question_lower:
+                    parsed["filters"].append({
+                        "column": col,
+                        "value": val
+                    })
 
         return parsed
 
     # -----------------------------
     # EXECUTE QUERY
     # -----------------------------
-    def execute_query(self, parsed):
+    def execute_query(self, parsed, workers=None, sample_fraction=None):
+
+        # Approximate sum/mean/count from a stratified sample of the data
+        if sample_fraction:
+            with stage("aggregation", sample_fraction=sample_fraction):
+                result = estimate_query(self, parsed, sample_fraction)
+            if result is not None:
+                return result
+
+        # Aggregates can be split across processes; everything else runs serially
+        if workers:
+            with stage("aggregation", workers=workers):
+                result = execute_parallel(self, parsed, workers)
+            if result is not None:
+                return result
+
+        aggregate = parsed["aggregation"] and parsed["metric"]
+
+        with stage("filtering") as info:
+            # Aggregates read row positions off the index (to split sums into
+            # the same blocks as the parallel path); row results keep the original
+            frame = self.df.set_axis(pd.RangeIndex(len(self.df))) if aggregate else self.df.copy()
+            result = self.filter_frame(frame, parsed)
+            info["rows"] = len(result)
+
+        if aggregate:
+            with stage("aggregation"):
+                series = result[parsed["metric"]]
+                # Same partials as the parallel path, so both return the same numbers
+                if mergeable_dtype(series.dtype):
+                    values, valid = metric_arrays(series)
+                    partial = partial_aggregate(values, valid, series.index.to_numpy())
+                    return result_frame(parsed, partial)
+
+                agg_func = parsed["aggregation"]
+                value = getattr(series, agg_func)()
+                return pd.DataFrame({f"{agg_func}_{parsed['metric']}": [value]})
 
-        result = self.df.copy()
+        return result
 
+    def filter_frame(self, result, parsed):
+        """Apply the parsed categorical and time filters to a frame of this dataset."""
         for f in parsed["filters"]:
             result = result[result[f["column"]] == f["value"]]
 
@@ -118,33 +206,96 @@ class SmartAnalyticsEngine:
             if "month" in parsed["time_filter"]:
                 result = result[result[date_col].dt.month == parsed["time_filter"]["month"]]
 
-        if parsed["aggregation"] and parsed["metric"]:
-            agg_func = parsed["aggregation"]
-            value = getattr(result[parsed["metric"]], agg_func)()
-            return pd.DataFrame({f"{agg_func}_{parsed['metric']}": [value]})
-
         return result
 
 
 # -----------------------------
 # HELPER FUNCTION
 # -----------------------------
-def run_query(df, question):
+def run_query(df, question, workers=None):
     engine = SmartAnalyticsEngine(df)
     parsed = engine.parse_question(question)
-    return engine.execute_query(parsed)
+    return engine.execute_query(parsed, workers)
+
+
+# -----------------------------
+# DATA LOADING
+# -----------------------------
+def load_table(file):
+    """Read an uploaded file (or a path) into a DataFrame, by extension."""
+    name = getattr(file, "name", str(file))
+    with stage("file_parsing", file=name) as info:
+        if name.endswith(".csv"):
+            df = pd.read_csv(file)
+        else:
+            df = pd.read_excel(file)
+        info["rows"] = len(df)
+    return df
+
+
+def coerce_date_columns(df):
+    """Parse every column with "date" in its name, in place."""
+    with stage("date_coercion"):
+        for col in df.columns:
+            if "date" in col.lower():
+                try:
+                    df[col] = pd.to_datetime(df[col])
+                except Exception:
+                    pass
+    return df
+
+
+# -----------------------------
+# FILTER PANEL
+# -----------------------------
+def apply_filters(df, selections):
+    """
+    Apply the filter panel selections to df.
+
+    selections maps a column to a date (datetime columns), a list of values
+    (categorical columns) or a (low, high) tuple (numeric columns). Empty
+    selections are ignored.
+    """
+    filtered_df = df
+
+    for col, selected in selections.items():
+        if selected is None or (isinstance(selected, list) and not selected):
+            continue
+
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            filtered_df = filtered_df[filtered_df[col].dt.date == selected]
+
+        elif pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            filtered_df = filtered_df[filtered_df[col].isin(selected)]
+
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            low, high = selected
+            filtered_df = filtered_df[(filtered_df[col] >= low) & (filtered_df[col] <= high)]
+
+    return filtered_df
 
 
 # -----------------------------
 # OPENROUTER AI FUNCTION
 # -----------------------------
-def ask_ai(df, question):
+@lru_cache(maxsize=None)
+def get_openrouter_client():
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
+    # Load environment variables
+    load_dotenv()
 
-    client = OpenAI(
+    return OpenAI(
         base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY
+        api_key=os.getenv("OPENROUTER_API_KEY")
     )
 
+
+def ask_ai(df, question):
+
+    client = get_openrouter_client()
+
     prompt = f"""
 You are a senior business data analyst.
 
@@ -165,14 +316,42 @@ Provide:
 5. Business recommendations
 """
 
-    try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-3.1-8b-instruct",  # 🔥 reliable free model
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
+    model = "meta-llama/llama-3.1-8b-instruct"  # 🔥 reliable free model
 
-        result = response.choices[0].message.content
+    try:
+        with stage("llm", model=model):
+            start = time.perf_counter()
+            first_token_at = None
+            usage = None
+            parts = []
+
+            # Stream so we can measure time-to-first-token; usage arrives in the last chunk
+            stream = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+
+            record_llm(
+                model=model,
+                seconds=time.perf_counter() - start,
+                ttft_seconds=first_token_at - start if first_token_at else None,
+                prompt_tokens=getattr(usage, "prompt_tokens", None),
+                completion_tokens=getattr(usage, "completion_tokens", None),
+                total_tokens=getattr(usage, "total_tokens", None),
+            )
+
+        result = "".join(parts)
 
         if not result:
             return "⚠️ AI returned an empty response. Try rephrasing your question."
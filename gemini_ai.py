@@ -1,8 +1,15 @@
-import google.generativeai as genai
 import pandas as pd
 import os
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel("gemini-1.5-flash")
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 def dataframe_context(df: pd.DataFrame):
     return f"""
@@ -37,8 +44,6 @@ Give:
 3. Suggested chart
 """
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
-
-    response = model.generate_content(prompt)
+    response = get_model().generate_content(prompt)
 
     return response.text
\ No newline at end of file
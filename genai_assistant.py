@@ -1,9 +1,14 @@
 import pandas as pd
-from openai import OpenAI
-import os
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    from openai import OpenAI
+
+    # Uses environment variable OPENAI_API_KEY
+    return OpenAI()
 
-# Uses environment variable OPENAI_API_KEY
-client = OpenAI()
 
 def dataframe_context(df: pd.DataFrame):
 
@@ -44,7 +49,7 @@ Respond in this format:
 4. Any risks or anomalies noticed
 """
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
@@ -0,0 +1,260 @@
+"""
+Out-of-core query execution over CSV or Parquet files larger than memory.
+
+OutOfCoreEngine never materializes the dataset. One scan at construction
+gathers what parse_question needs (column types and the distinct values of
+text columns); each query then streams the file in batches, reading only
+the metric, filter and date columns, and merges per-batch partial
+aggregates. Peak memory is bounded by the batch size (plus the distinct
+values of the text columns).
+
+Questions without an aggregation return rows, and there could be more of
+them than fit in memory: the scan stops after ``row_limit`` matching rows
+and the result is marked ``result.attrs["truncated"] = True``.
+
+    engine = OutOfCoreEngine("history.parquet")
+    engine.execute_query(engine.parse_question("total Sales for East in 2021"))
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregates import partial_aggregate, merge_partials, result_frame
+from engine import SmartAnalyticsEngine
+from tracing import stage
+
+DEFAULT_BATCH_ROWS = 500_000
+DEFAULT_ROW_LIMIT = 100_000
+
+
+def _is_parquet(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow.dataset as ds
+        import pyarrow.compute as pc
+    except ImportError:
+        raise ImportError("Reading Parquet files out of core requires pyarrow (pip install pyarrow)")
+    return ds, pc
+
+
+class OutOfCoreEngine(SmartAnalyticsEngine):
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_ROWS, row_limit=DEFAULT_ROW_LIMIT):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.row_limit = row_limit
+        self.df = None
+
+        # The file is re-read on every query, so identify it by path and the
+        # stat it had when it was scanned (a rewrite means a new engine)
+        stat = os.stat(self.path)
+        self._fingerprint = f"{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        with stage("schema_scan", file=self.path):
+            if _is_parquet(self.path):
+                self._scan_parquet_schema()
+            else:
+                self._scan_csv_schema()
+
+        self.lower_columns = [c.lower() for c in self.columns]
+
+    # -----------------------------
+    # SCHEMA SCAN
+    # -----------------------------
+    def _scan_parquet_schema(self):
+        ds, pc = _import_pyarrow()
+        import pyarrow as pa
+
+        dataset = ds.dataset(self.path, format="parquet")
+        schema = dataset.schema
+
+        self.columns = schema.names
+        self.rows = dataset.count_rows()
+        self.date_columns = [
+            f.name for f in schema
+            if pa.types.is_timestamp(f.type) or pa.types.is_date(f.type)
+        ]
+        self.numeric_columns = [
+            f.name for f in schema
+            if pa.types.is_integer(f.type) or pa.types.is_floating(f.type) or pa.types.is_boolean(f.type)
+        ]
+
+        text_columns = [
+            f.name for f in schema
+            if pa.types.is_string(f.type) or pa.types.is_large_string(f.type) or pa.types.is_dictionary(f.type)
+        ]
+        values = {col: {} for col in text_columns}
+        if text_columns:
+            for batch in dataset.to_batches(columns=text_columns, batch_size=self.batch_size):
+                for col in text_columns:
+                    uniques = pc.unique(batch.column(col)).drop_null()
+                    values[col].update(dict.fromkeys(uniques.to_pylist()))
+
+        self._categorical_values = {col: list(v) for col, v in values.items()}
+
+    def _scan_csv_schema(self):
+        numeric = None
+        dates = None
+        values = {}
+        self.rows = 0
+        self.columns = pd.read_csv(self.path, nrows=0).columns.tolist()
+
+        for chunk in pd.read_csv(self.path, chunksize=self.batch_size):
+            self.rows += len(chunk)
+
+            # Values as read, before date coercion: a date column that fails
+            # to parse anywhere stays text, as it would in memory
+            for col in chunk.columns:
+                if pd.api.types.is_object_dtype(chunk[col]) or pd.api.types.is_string_dtype(chunk[col]):
+                    values.setdefault(col, {}).update(dict.fromkeys(chunk[col].dropna().unique()))
+
+            chunk = self._coerce_dates(chunk)
+
+            chunk_numeric = {
+                col for col in chunk.columns if pd.api.types.is_numeric_dtype(chunk[col])
+            }
+            numeric = chunk_numeric if numeric is None else numeric & chunk_numeric
+
+            chunk_dates = {
+                col for col in chunk.columns if pd.api.types.is_datetime64_any_dtype(chunk[col])
+            }
+            dates = chunk_dates if dates is None else dates & chunk_dates
+
+        if numeric is None:
+            # Header-only file
+            numeric = dates = set()
+
+        self.numeric_columns = [col for col in self.columns if col in numeric]
+        # Only a column that parsed in every chunk is a date column
+        self.date_columns = [col for col in self.columns if col in dates]
+        # A column that was text in any chunk can't also be a metric
+        self._categorical_values = {
+            col: list(v) for col, v in values.items() if col not in numeric and col not in dates
+        }
+
+    @staticmethod
+    def _coerce_dates(chunk):
+        # Same rule the app applies to uploaded files
+        for col in chunk.columns:
+            if "date" in col.lower():
+                try:
+                    chunk[col] = pd.to_datetime(chunk[col])
+                except Exception:
+                    pass
+        return chunk
+
+    def categorical_values(self):
+        return self._categorical_values
+
+    def fingerprint(self, compute=True):
+        return self._fingerprint
+
+    # -----------------------------
+    # EXECUTE QUERY
+    # -----------------------------
+    def _needed_columns(self, parsed):
+        needed = [f["column"] for f in parsed["filters"]]
+        if parsed["time_filter"] and self.date_columns:
+            needed.append(self.date_columns[0])
+        if parsed["metric"]:
+            needed.append(parsed["metric"])
+        return list(dict.fromkeys(needed))
+
+    def execute_query(self, parsed, workers=None, sample_fraction=None):
+        # workers and sample_fraction only apply in memory; a scan is always exact
+        aggregate = bool(parsed["aggregation"] and parsed["metric"])
+        # Row results need every column; aggregates only what the query touches
+        columns = self._needed_columns(parsed) if aggregate else self.columns
+
+        with stage("scan", file=self.path) as info:
+            if _is_parquet(self.path):
+                batches = self._parquet_batches(parsed, columns)
+            else:
+                batches = self._csv_batches(parsed, columns)
+
+            partials = []
+            frames = []
+            matched = 0
+            truncated = False
+            info["batches"] = 0
+            for batch in batches:
+                info["batches"] += 1
+                if aggregate:
+                    partials.append(partial_aggregate(batch[parsed["metric"]].to_numpy()))
+                    continue
+
+                frames.append(batch.iloc[:self.row_limit - matched])
+                matched += len(batch)
+                if matched >= self.row_limit:
+                    # The rest of the file could be larger than memory
+                    truncated = matched > self.row_limit or any(len(b) for b in batches)
+                    batches.close()
+                    break
+            info["truncated"] = truncated
+
+        if aggregate:
+            if not partials:
+                # Every row group was pruned; an empty batch keeps the metric's dtype
+                partials.append(partial_aggregate(np.array([], dtype=self._metric_dtype(parsed["metric"]))))
+            with stage("aggregation"):
+                return result_frame(parsed, merge_partials(partials))
+
+        if frames:
+            result = pd.concat(frames, ignore_index=True)
+        else:
+            result = pd.DataFrame(columns=self.columns)
+        result.attrs["truncated"] = truncated
+        return result
+
+    def _metric_dtype(self, metric):
+        if _is_parquet(self.path):
+            ds, _ = _import_pyarrow()
+            return ds.dataset(self.path, format="parquet").schema.field(metric).type.to_pandas_dtype()
+        return np.float64
+
+    def _csv_batches(self, parsed, columns):
+        for chunk in pd.read_csv(self.path, usecols=columns, chunksize=self.batch_size):
+            # The schema scan parsed these in every chunk; coerce keeps the
+            # dtype datetime64 even if the file changed since
+            for col in self.date_columns:
+                if col in chunk.columns:
+                    chunk[col] = pd.to_datetime(chunk[col], errors="coerce")
+
+            for f in parsed["filters"]:
+                chunk = chunk[chunk[f["column"]] == f["value"]]
+
+            if parsed["time_filter"] and self.date_columns:
+                date_col = self.date_columns[0]
+
+                if "year" in parsed["time_filter"]:
+                    chunk = chunk[chunk[date_col].dt.year == parsed["time_filter"]["year"]]
+
+                if "month" in parsed["time_filter"]:
+                    chunk = chunk[chunk[date_col].dt.month == parsed["time_filter"]["month"]]
+
+            yield chunk
+
+    def _parquet_batches(self, parsed, columns):
+        ds, pc = _import_pyarrow()
+
+        expr = None
+        conditions = [pc.field(f["column"]) == f["value"] for f in parsed["filters"]]
+
+        if parsed["time_filter"] and self.date_columns:
+            date_field = pc.field(self.date_columns[0])
+            if "year" in parsed["time_filter"]:
+                conditions.append(pc.year(date_field) == parsed["time_filter"]["year"])
+            if "month" in parsed["time_filter"]:
+                conditions.append(pc.month(date_field) == parsed["time_filter"]["month"])
+
+        for condition in conditions:
+            expr = condition if expr is None else expr & condition
+
+        dataset = ds.dataset(self.path, format="parquet")
+        for batch in dataset.to_batches(columns=columns, filter=expr, batch_size=self.batch_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
@@ -0,0 +1,260 @@
+"""
+Multi-core execution of aggregate queries.
+
+The columns a query needs are copied once per engine into shared memory
+(categoricals as integer codes, dates as raw datetime64 integers), so worker
+processes attach to them instead of receiving pickled shards. Each worker
+filters its row range and returns a partial aggregate; the partials are
+merged in the parent.
+
+Results match the serial path exactly: shards are cut at the block
+boundaries float sums are split on (aggregates.BLOCK_ROWS), so both paths
+add the same numbers in the same order.
+
+Workers are started with forkserver (spawn where it isn't available), since
+forking a process that runs service or Streamlit threads can deadlock.
+"""
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from aggregates import BLOCK_ROWS, mergeable_dtype, metric_arrays, partial_aggregate, merge_partials, result_frame
+
+# One pool per worker count: a pool another thread may be using is never shut down
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _get_pool(workers):
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context())
+        return pool
+
+
+def _discard_pool(workers, pool):
+    """Forget a broken pool, unless another thread has already replaced it."""
+    with _pool_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _map_shards(workers, tasks):
+    """Partials of every task; retried once on a fresh pool if a worker died."""
+    for attempt in range(2):
+        pool = _get_pool(workers)
+        try:
+            return list(pool.map(_shard_partial, tasks))
+        except BrokenProcessPool:
+            # A worker was killed (e.g. out of memory); later queries get a new pool
+            _discard_pool(workers, pool)
+    return None
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: don't let workers' resource trackers unlink our blocks
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+# -----------------------------
+# SHARED COLUMNS
+# -----------------------------
+class SharedFrame:
+    """Shared-memory copies of the columns of one DataFrame, built on demand."""
+
+    def __init__(self, df):
+        self.df = df
+        self.rows = len(df)
+        self._blocks = {}
+        self._specs = {}
+        self._uniques = {}
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _release_blocks, self._blocks)
+
+    def _share(self, key, values):
+        values = np.ascontiguousarray(values)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+        self._blocks[key] = block
+        self._specs[key] = (block.name, values.dtype.str, len(values))
+
+    def values(self, col):
+        """Spec of a numeric or datetime column, shared as-is."""
+        key = ("values", col)
+        with self._lock:
+            if key not in self._specs:
+                self._share(key, self.df[col].to_numpy())
+            return self._specs[key]
+
+    def metric(self, col):
+        """Specs of a metric column's values and validity mask (None if unmasked)."""
+        key = ("metric", col)
+        with self._lock:
+            if key not in self._specs:
+                values, valid = metric_arrays(self.df[col])
+                self._share(key, values)
+                if valid is not None:
+                    self._share(("valid", col), valid)
+            return self._specs[key], self._specs.get(("valid", col))
+
+    def codes(self, col):
+        """Spec of a column factorized to integer codes, plus its uniques."""
+        key = ("codes", col)
+        with self._lock:
+            if key not in self._specs:
+                codes, uniques = pd.factorize(self.df[col])
+                self._share(key, codes.astype(_code_dtype(len(uniques))))
+                self._uniques[col] = pd.Index(uniques)
+            return self._specs[key], self._uniques[col]
+
+    def close(self):
+        self._finalizer()
+
+
+def _code_dtype(n_uniques):
+    """Smallest signed int dtype for codes -2 (no match), -1 (missing) .. n_uniques - 1."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_uniques <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _release_blocks(blocks):
+    for block in blocks.values():
+        block.close()
+        block.unlink()
+    blocks.clear()
+
+
+# -----------------------------
+# WORKER
+# -----------------------------
+def _shard_partial(task):
+    start, stop = task["range"]
+    blocks = []
+
+    def view(spec):
+        name, dtype, length = spec
+        block = _attach(name)
+        blocks.append(block)
+        return np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf)[start:stop]
+
+    try:
+        return _filtered_partial(task, view)
+    finally:
+        # All views are gone once _filtered_partial returns, so closing can't fail
+        for block in blocks:
+            block.close()
+
+
+def _filtered_partial(task, view):
+    start, stop = task["range"]
+    mask = np.ones(stop - start, dtype=bool)
+
+    for spec, code in task["filters"]:
+        mask &= view(spec) == code
+
+    if task["date"] is not None:
+        dates = view(task["date"])
+        mask &= ~np.isnat(dates)
+        if "year" in task["time_filter"]:
+            years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+            mask &= years == task["time_filter"]["year"]
+        if "month" in task["time_filter"]:
+            months = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+            mask &= months == task["time_filter"]["month"]
+
+    values_spec, valid_spec = task["metric"]
+    if valid_spec is not None:
+        mask &= view(valid_spec)
+    positions = start + np.flatnonzero(mask)
+    return partial_aggregate(view(values_spec)[mask], positions=positions)
+
+
+# -----------------------------
+# PARALLEL EXECUTION
+# -----------------------------
+def can_parallelize(engine, parsed):
+    if not (parsed["aggregation"] and parsed["metric"]):
+        return False
+
+    if not mergeable_dtype(engine.df[parsed["metric"]].dtype):
+        return False
+
+    if parsed["time_filter"] and engine.date_columns:
+        # tz-aware columns would need local-time year/month, keep them serial
+        if not isinstance(engine.df[engine.date_columns[0]].dtype, np.dtype):
+            return False
+
+    return True
+
+
+def execute_parallel(engine, parsed, workers=None):
+    """
+    Run an aggregate query across ``workers`` processes.
+
+    Returns None when the query can't be split (no aggregation, or a metric
+    or date column numpy can't share) or the workers keep dying, so the
+    caller can run it serially.
+    """
+    if not can_parallelize(engine, parsed):
+        return None
+
+    workers = workers or os.cpu_count() or 1
+
+    shared = getattr(engine, "_shared_frame", None)
+    if shared is None:
+        shared = engine._shared_frame = SharedFrame(engine.df)
+
+    filters = []
+    for f in parsed["filters"]:
+        spec, uniques = shared.codes(f["column"])
+        code = uniques.get_indexer([f["value"]])[0]
+        # Unknown values get -2, which matches no code (missing values are -1)
+        filters.append((spec, code if code >= 0 else -2))
+
+    date_spec = None
+    if parsed["time_filter"] and engine.date_columns:
+        date_spec = shared.values(engine.date_columns[0])
+
+    metric_spec = shared.metric(parsed["metric"])
+
+    # Whole blocks per shard; small frames get fewer shards than workers
+    blocks = -(-shared.rows // BLOCK_ROWS)
+    bounds = np.unique(np.minimum(
+        np.linspace(0, blocks, workers + 1).astype(np.int64) * BLOCK_ROWS, shared.rows
+    ))
+    tasks = [
+        {
+            "range": (int(bounds[i]), int(bounds[i + 1])),
+            "filters": filters,
+            "date": date_spec,
+            "time_filter": parsed["time_filter"],
+            "metric": metric_spec,
+        }
+        for i in range(len(bounds) - 1)
+    ]
+    if not tasks:
+        return None
+
+    partials = _map_shards(workers, tasks)
+    if partials is None:
+        return None
+    return result_frame(parsed, merge_partials(partials))
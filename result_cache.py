@@ -0,0 +1,106 @@
+"""
+Memoized query results.
+
+Results are keyed by (dataset fingerprint, canonical parsed query), so
+different phrasings that parse to the same query share one entry, and a
+changed dataset never sees results computed for its previous contents.
+Entries are evicted least-recently-used first once their total size
+exceeds ``max_bytes``.
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def canonical_query(parsed, sample_fraction=None):
+    """Hashable form of a parse_question dict; filter order doesn't matter."""
+    filters = tuple(sorted(
+        (f["column"], type(f["value"]).__name__, str(f["value"])) for f in parsed["filters"]
+    ))
+    return (
+        parsed["aggregation"],
+        parsed["metric"],
+        filters,
+        tuple(sorted(parsed["time_filter"].items())),
+        sample_fraction,
+    )
+
+
+class ResultCache:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers get their own copy, so they can't alter the cached result
+        return entry[0].copy()
+
+    def put(self, key, result):
+        size = int(result.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result.copy(), size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, fingerprint):
+        """Drop every result computed on the dataset with this fingerprint."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == fingerprint]
+            for key in stale:
+                self._bytes -= self._entries.pop(key)[1]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def cached_query(engine, parsed, cache, workers=None, sample_fraction=None):
+    """engine.execute_query, answered from ``cache`` when possible."""
+    key = (engine.fingerprint(), canonical_query(parsed, sample_fraction))
+
+    result = cache.get(key)
+    if result is None:
+        result = engine.execute_query(parsed, workers, sample_fraction=sample_fraction)
+        cache.put(key, result)
+    return result
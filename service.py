@@ -0,0 +1,479 @@
+"""
+Headless HTTP service for the analytics engine.
+
+Datasets are registered once and kept warm, together with their engine, in
+a process-wide pool shared by every client. Queries run on a worker pool;
+when more than ``max_pending`` queries are queued the service answers 503
+instead of piling up work. Results are memoized in a shared ResultCache
+whose hit rate is reported by /health.
+
+Query threads share one interpreter, so pandas work that holds the GIL
+doesn't spread over cores. ``--processes N`` forks N server processes that
+accept on the same socket, each with its own warm pool; datasets given at
+startup are loaded before the fork, and datasets registered later are
+loaded by every process on its next request.
+
+Clients can only register files under ``--data-dir`` (default: the
+working directory); any other path is answered with 403.
+
+    python service.py --port 8000 --processes 4 --data-dir data --dataset sales=data/sales.csv
+
+Endpoints (JSON in, JSON out):
+
+    GET  /health
+    GET  /datasets
+    POST /datasets   {"name": "sales", "path": "sales.csv"}  (relative to --data-dir)
+                     add "out_of_core": true to query the file without loading it
+                     (datasets registered by path are shared by every process)
+    POST /query      {"dataset": "sales", "question": "total Sales in march 2024"}
+                     add "sample_fraction": 0.01 for an estimate with a confidence interval
+    POST /batch      {"dataset": "sales", "questions": ["...", "..."]}
+                     at most max_pending questions; larger batches get 413
+"""
+import argparse
+import json
+import os
+import signal
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from approx import prepare_sample
+from engine import SmartAnalyticsEngine, load_table, coerce_date_columns
+from outofcore import OutOfCoreEngine
+from result_cache import ResultCache, cached_query
+from tracing import QueryTrace
+
+
+class ServiceError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# -----------------------------
+# DATASET POOL
+# -----------------------------
+class DatasetPool:
+    """
+    Registered datasets and their warm engines, shared across clients.
+
+    With a ``registry_path``, datasets registered by path are also recorded
+    in that JSON file, and pools of other processes reading the same file
+    load them on their next lookup. With a ``data_dir``, resolve_path()
+    confines client-supplied paths to that directory.
+    """
+
+    def __init__(self, result_cache=None, registry_path=None, data_dir=None):
+        self.result_cache = result_cache
+        self.registry_path = registry_path
+        self.data_dir = data_dir
+        self._engines = {}
+        self._lock = threading.Lock()
+
+        self._versions = {}
+        self._failed = {}
+        self._registry_stamp = None
+        self._sync_lock = threading.Lock()
+        self._warming = []
+
+    def register(self, name, df):
+        return self._add(name, SmartAnalyticsEngine(df))
+
+    def register_path(self, name, path, out_of_core=False):
+        description = self._load_path(name, path, out_of_core)
+        if self.registry_path is not None:
+            self._versions[name] = self._record(name, path, out_of_core)
+        return description
+
+    def resolve_path(self, path):
+        """Real path of a client-supplied dataset path; 403 if it leaves data_dir."""
+        if self.data_dir is None:
+            return path
+        root = os.path.realpath(self.data_dir)
+        # realpath follows symlinks, so a link can't point out of the root
+        real = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, real]) != root:
+            raise ServiceError(403, f"Path is outside the data directory: {path}")
+        return real
+
+    def _load_path(self, name, path, out_of_core):
+        with QueryTrace(source="service", dataset=name, path=path):
+            if out_of_core:
+                return self._add(name, OutOfCoreEngine(path))
+            df = coerce_date_columns(load_table(path))
+        return self.register(name, df)
+
+    # -----------------------------
+    # SHARED REGISTRY
+    # -----------------------------
+    def _read_registry(self):
+        try:
+            with open(self.registry_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _record(self, name, path, out_of_core):
+        import fcntl  # POSIX only, like the os.fork that needs the registry
+
+        version = uuid.uuid4().hex
+        with open(self.registry_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            registry = self._read_registry()
+            registry[name] = {"path": path, "out_of_core": out_of_core, "version": version}
+
+            # Readers never see a half-written file
+            tmp = f"{self.registry_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(registry, f)
+            os.replace(tmp, self.registry_path)
+        return version
+
+    def _sync(self):
+        """Load datasets other processes registered since the last lookup."""
+        try:
+            stat = os.stat(self.registry_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._registry_stamp:
+            return
+
+        with self._sync_lock:
+            if stamp == self._registry_stamp:
+                return
+            for name, spec in self._read_registry().items():
+                if self._versions.get(name) != spec["version"]:
+                    # Recorded either way: a bad entry is reported for its
+                    # own dataset, not retried on every lookup of the others
+                    self._versions[name] = spec["version"]
+                    try:
+                        self._load_path(name, spec["path"], spec["out_of_core"])
+                    except Exception as e:
+                        self._fail(name, f"{type(e).__name__}: {e}")
+            self._registry_stamp = stamp
+
+    def _fail(self, name, error):
+        with self._lock:
+            previous = self._engines.pop(name, None)
+            self._failed[name] = error
+        # Its old data is no longer what the name refers to
+        if previous is not None and self.result_cache is not None:
+            fingerprint = previous.fingerprint(compute=False)
+            if fingerprint is not None:
+                self.result_cache.invalidate(fingerprint)
+
+    def _add(self, name, engine):
+        with self._lock:
+            previous = self._engines.get(name)
+            self._engines[name] = engine
+            self._failed.pop(name, None)
+
+        # Sampled and hashed in the background, so neither the first estimate
+        # nor the first cached query waits for it
+        self._warming = [t for t in self._warming if t.is_alive()]
+        for thread in (prepare_sample(engine), self._hash_in_background(engine)):
+            if thread is not None:
+                self._warming.append(thread)
+
+        # Re-registering a name drops the results cached for its old data
+        if previous is not None and self.result_cache is not None:
+            fingerprint = previous.fingerprint(compute=False)
+            if fingerprint is not None:
+                self.result_cache.invalidate(fingerprint)
+
+        return self.describe(name)
+
+    @staticmethod
+    def _hash_in_background(engine):
+        if engine.fingerprint(compute=False) is not None:
+            return None
+        thread = threading.Thread(target=engine.fingerprint, name="fingerprint", daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, name):
+        if self.registry_path is not None:
+            self._sync()
+        return self._get(name)
+
+    def _get(self, name):
+        with self._lock:
+            engine = self._engines.get(name)
+            error = self._failed.get(name)
+        if error is not None:
+            raise ServiceError(500, f"Dataset {name} failed to load: {error}")
+        if engine is None:
+            raise ServiceError(404, f"Unknown dataset: {name}")
+        return engine
+
+    def describe(self, name):
+        engine = self._get(name)
+        return {
+            "name": name,
+            "rows": engine.rows,
+            "columns": engine.columns,
+            "date_columns": engine.date_columns,
+            "out_of_core": isinstance(engine, OutOfCoreEngine),
+        }
+
+    def wait_until_warm(self):
+        """Wait for the samples of the datasets registered so far."""
+        while self._warming:
+            self._warming.pop().join()
+
+    def names(self):
+        if self.registry_path is not None:
+            self._sync()
+        with self._lock:
+            return list(self._engines)
+
+
+# -----------------------------
+# QUERY SERVICE
+# -----------------------------
+class QueryService:
+
+    def __init__(self, pool=None, workers=None, max_pending=None, query_workers=None,
+                 result_cache=None, registry_path=None, data_dir=None):
+        self.result_cache = result_cache or ResultCache()
+        self.pool = pool or DatasetPool(self.result_cache, registry_path, data_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.query_workers = query_workers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="query")
+
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def _admit(self, n):
+        with self._pending_lock:
+            if self._pending + n > self.max_pending:
+                raise ServiceError(503, "Service busy, retry later")
+            self._pending += n
+
+    def _release(self, n):
+        with self._pending_lock:
+            self._pending -= n
+
+    def _run(self, dataset, question, sample_fraction=None):
+        engine = self.pool.get(dataset)
+        with QueryTrace(source="service", dataset=dataset, question=question):
+            parsed = engine.parse_question(question)
+            result = cached_query(
+                engine, parsed, self.result_cache, self.query_workers, sample_fraction
+            )
+        return {
+            "question": question,
+            "parsed": parsed,
+            "result": json.loads(result.to_json(orient="records", date_format="iso")),
+            # Out-of-core row results stop at the engine's row limit
+            "truncated": result.attrs.get("truncated", False),
+        }
+
+    def run_query(self, dataset, question, sample_fraction=None):
+        return self.run_batch(dataset, [question], sample_fraction)[0]
+
+    def run_batch(self, dataset, questions, sample_fraction=None):
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+            raise ServiceError(400, "questions must be a list of strings")
+        # Retrying can't help a batch that never fits, so don't answer 503
+        if len(questions) > self.max_pending:
+            raise ServiceError(
+                413, f"Batch of {len(questions)} questions exceeds max_pending={self.max_pending}"
+            )
+        if sample_fraction is not None and (
+            isinstance(sample_fraction, bool)
+            or not isinstance(sample_fraction, (int, float))
+            or not 0 < sample_fraction <= 1
+        ):
+            raise ServiceError(400, "sample_fraction must be a number in (0, 1]")
+
+        self.pool.get(dataset)
+        self._admit(len(questions))
+        try:
+            futures = [
+                self.executor.submit(self._run, dataset, q, sample_fraction) for q in questions
+            ]
+            return [f.result() for f in futures]
+        finally:
+            self._release(len(questions))
+
+    def stats(self):
+        with self._pending_lock:
+            pending = self._pending
+        return {
+            "pid": os.getpid(),
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "query_workers": self.query_workers,
+            "pending": pending,
+            "datasets": self.pool.names(),
+            "result_cache": self.result_cache.stats(),
+        }
+
+
+# -----------------------------
+# HTTP LAYER
+# -----------------------------
+def make_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 503:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                return json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                raise ServiceError(400, "Request body must be JSON")
+
+        def _require(self, body, *keys):
+            missing = [k for k in keys if k not in body]
+            if missing:
+                raise ServiceError(400, f"Missing field(s): {', '.join(missing)}")
+
+        def _dispatch(self, handler):
+            try:
+                self._send(200, handler())
+            except ServiceError as e:
+                self._send(e.status, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def do_GET(self):
+            routes = {
+                "/health": lambda: {"status": "ok", **service.stats()},
+                "/datasets": lambda: [service.pool.describe(n) for n in service.pool.names()],
+            }
+            route = routes.get(self.path)
+            if route is None:
+                return self._send(404, {"error": f"Not found: {self.path}"})
+            self._dispatch(route)
+
+        def do_POST(self):
+            if self.path == "/datasets":
+                def route():
+                    body = self._body()
+                    self._require(body, "name", "path")
+                    if not isinstance(body["path"], str):
+                        raise ServiceError(400, "path must be a string")
+                    return service.pool.register_path(
+                        body["name"], service.pool.resolve_path(body["path"]),
+                        body.get("out_of_core", False)
+                    )
+
+            elif self.path == "/query":
+                def route():
+                    body = self._body()
+                    self._require(body, "dataset", "question")
+                    return service.run_query(
+                        body["dataset"], body["question"], body.get("sample_fraction")
+                    )
+
+            elif self.path == "/batch":
+                def route():
+                    body = self._body()
+                    self._require(body, "dataset", "questions")
+                    return {"results": service.run_batch(
+                        body["dataset"], body["questions"], body.get("sample_fraction")
+                    )}
+
+            else:
+                return self._send(404, {"error": f"Not found: {self.path}"})
+
+            self._dispatch(route)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8000, workers=None, max_pending=None, datasets=None,
+          query_workers=None, processes=1, data_dir="."):
+    if processes > 1 and not hasattr(os, "fork"):
+        raise SystemExit("--processes needs a platform with os.fork")
+
+    registry_dir = tempfile.TemporaryDirectory(prefix="analytics-service-")
+    registry_path = os.path.join(registry_dir.name, "datasets.json") if processes > 1 else None
+
+    service = QueryService(workers=workers, max_pending=max_pending, query_workers=query_workers,
+                           registry_path=registry_path, data_dir=data_dir)
+    # Startup datasets come from the operator, so data_dir doesn't apply.
+    # They're loaded before forking, so every process starts with them warm
+    for name, path in (datasets or {}).items():
+        service.pool.register_path(name, path)
+    # Forking while a sampling thread holds a lock could deadlock the children
+    service.pool.wait_until_warm()
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving on http://{host}:{port} with {processes} process(es) "
+          f"x {service.workers} workers")
+
+    children = []
+    for _ in range(processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.executor.shutdown()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        registry_dir.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Smart Analytics Engine service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Server processes sharing the port, for queries on several cores")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Query worker threads per process (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Queued queries per process before answering 503 (default: 4 x workers)")
+    parser.add_argument("--query-workers", type=int, default=None,
+                        help="Processes to split each aggregate query across (default: serial)")
+    parser.add_argument("--data-dir", default=".",
+                        help="Directory clients may register dataset files from (default: .)")
+    parser.add_argument("--dataset", action="append", default=[], metavar="NAME=PATH",
+                        help="Dataset to register at startup (repeatable)")
+    args = parser.parse_args(argv)
+
+    datasets = dict(spec.split("=", 1) for spec in args.dataset)
+    serve(args.host, args.port, args.workers, args.max_pending, datasets, args.query_workers,
+          args.processes, args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from approx import get_sample, prepare_sample, estimate_query
+from benchmark import make_sales_dataset
+from engine import SmartAnalyticsEngine
+
+
+def test_empty_dataset_runs_exactly():
+    engine = SmartAnalyticsEngine(make_sales_dataset(0))
+    parsed = engine.parse_question("total Sales")
+
+    assert estimate_query(engine, parsed, 0.01) is None
+    assert prepare_sample(engine) is None
+    pd.testing.assert_frame_equal(
+        engine.execute_query(parsed, sample_fraction=0.01), engine.execute_query(parsed)
+    )
+
+
+def test_samples_are_nested_and_stratified():
+    engine = SmartAnalyticsEngine(make_sales_dataset(20_000, seed=4))
+    prepare_sample(engine).join()
+    sample = get_sample(engine)
+
+    small, small_strata, small_n = sample.take(0.01)
+    large, large_strata, large_n = sample.take(0.1)
+
+    assert sample.strata_column == "Region"
+    assert (small_n == np.ceil(sample.strata_sizes * 0.01)).all()
+    assert (large_n == np.ceil(sample.strata_sizes * 0.1)).all()
+    assert set(map(tuple, small.to_numpy())) <= set(map(tuple, large.to_numpy()))
+    # Every sampled row belongs to the stratum it's counted in
+    labels = np.asarray(pd.factorize(engine.df["Region"])[1])
+    assert (small["Region"].to_numpy() == labels[small_strata]).all()
+
+
+def test_estimate_interval_covers_exact_answer():
+    engine = SmartAnalyticsEngine(make_sales_dataset(50_000, seed=5))
+    parsed = engine.parse_question("total Sales for East")
+
+    exact = engine.execute_query(parsed).iloc[0, 0]
+    estimate = engine.execute_query(parsed, sample_fraction=0.1)
+
+    assert estimate["ci_low"].iloc[0] <= exact <= estimate["ci_high"].iloc[0]
+
+
+def _rows(frame):
+    return set(map(tuple, frame.to_numpy()))
+
+
+def test_larger_fractions_extend_the_sample():
+    engine = SmartAnalyticsEngine(make_sales_dataset(20_000, seed=7))
+    sample = get_sample(engine)
+
+    samples = [sample.take(fraction)[0] for fraction in (0.01, 0.1, 0.3, 0.05, 0.6)]
+    by_size = sorted(samples, key=len)
+    for smaller, larger in zip(by_size, by_size[1:]):
+        assert _rows(smaller) <= _rows(larger)
+    # Rows are drawn without replacement
+    assert len(_rows(samples[-1])) == len(samples[-1])
+
+
+def test_concurrent_first_takes_share_one_draw():
+    engine = SmartAnalyticsEngine(make_sales_dataset(50_000, seed=8))
+    sample = get_sample(engine)
+
+    start = threading.Barrier(8)
+
+    def take(fraction):
+        start.wait()
+        sample.take(fraction)
+
+    threads = [threading.Thread(target=take, args=(f,)) for f in (0.01, 0.1) * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _rows(sample.take(0.01)[0]) <= _rows(sample.take(0.1)[0])
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+from benchmark import make_sales_dataset
+from engine import SmartAnalyticsEngine, load_table, coerce_date_columns
+from outofcore import DEFAULT_ROW_LIMIT, OutOfCoreEngine
+
+QUESTIONS = [
+    "total Sales",
+    "total Sales for East",
+    "average Quantity in march 2022",
+    "count Sales for West in 2023",
+    "max Sales for Product 00003",
+    "min Quantity in 2022",
+    "total Sales for East in december 2030",
+]
+
+
+@pytest.fixture(scope="module")
+def sales():
+    return make_sales_dataset(5_000, days=730, seed=2)
+
+
+@pytest.fixture(scope="module", params=["csv", "parquet"])
+def engines(request, sales, tmp_path_factory):
+    path = tmp_path_factory.mktemp("data") / f"sales.{request.param}"
+    if request.param == "csv":
+        sales.to_csv(path, index=False)
+        in_memory = SmartAnalyticsEngine(coerce_date_columns(load_table(str(path))))
+    else:
+        sales.to_parquet(path, index=False)
+        in_memory = SmartAnalyticsEngine(pd.read_parquet(path))
+    return in_memory, OutOfCoreEngine(path, batch_size=700)
+
+
+def test_schema_matches_in_memory(engines):
+    in_memory, out_of_core = engines
+
+    assert out_of_core.rows == in_memory.rows
+    assert out_of_core.columns == in_memory.columns
+    assert out_of_core.date_columns == in_memory.date_columns
+    assert out_of_core.numeric_columns == in_memory.numeric_columns
+    assert {col: sorted(v) for col, v in out_of_core.categorical_values().items()} == \
+        {col: sorted(v) for col, v in in_memory.categorical_values().items()}
+
+
+@pytest.mark.parametrize("question", QUESTIONS)
+def test_query_matches_in_memory(engines, question):
+    in_memory, out_of_core = engines
+    parsed = in_memory.parse_question(question)
+
+    assert out_of_core.parse_question(question) == parsed
+    # Batches add float sums in a different order than the in-memory blocks
+    pd.testing.assert_frame_equal(
+        out_of_core.execute_query(parsed), in_memory.execute_query(parsed), check_exact=False, rtol=1e-12
+    )
+
+
+def test_date_column_must_parse_in_every_chunk(tmp_path):
+    path = tmp_path / "orders.csv"
+    path.write_text(
+        "Order Date,Region,Sales\n"
+        "bogus,East,1\n"
+        "2022-01-02,East,2\n"
+        "2022-03-01,West,3\n"
+        "2022-03-05,East,4\n"
+        "2023-03-05,East,5\n"
+    )
+    in_memory = SmartAnalyticsEngine(coerce_date_columns(load_table(str(path))))
+    out_of_core = OutOfCoreEngine(path, batch_size=2)
+
+    # "bogus" keeps the whole column text in memory, so out of core too
+    assert out_of_core.date_columns == in_memory.date_columns == []
+    for question in ("total Sales in march 2022", "total Sales for East"):
+        parsed = in_memory.parse_question(question)
+        pd.testing.assert_frame_equal(out_of_core.execute_query(parsed), in_memory.execute_query(parsed))
+
+
+@pytest.mark.parametrize("row_limit, truncated", [(100, True), (1_000_000, False)])
+def test_row_results_stop_at_the_row_limit(engines, row_limit, truncated):
+    in_memory, out_of_core = engines
+    parsed = in_memory.parse_question("show orders for East")
+    assert not parsed["aggregation"]
+
+    out_of_core.row_limit = row_limit
+    try:
+        result = out_of_core.execute_query(parsed)
+    finally:
+        out_of_core.row_limit = DEFAULT_ROW_LIMIT
+
+    expected = in_memory.execute_query(parsed).reset_index(drop=True).head(row_limit)
+    assert result.attrs["truncated"] is truncated
+    assert len(result) == len(expected)
+    assert (result["Sales"].to_numpy() == expected["Sales"].to_numpy()).all()
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import make_sales_dataset
+from engine import SmartAnalyticsEngine
+
+AGGREGATIONS = ["sum", "count", "mean", "min", "max"]
+
+FILTERS = {
+    "none": ([], {}),
+    "region": ([{"column": "Region", "value": "East"}], {}),
+    "month": ([], {"year": 2022, "month": 3}),
+    "region_and_year": ([{"column": "Region", "value": "West"}], {"year": 2022}),
+    "no_match": ([{"column": "Region", "value": "Atlantis"}], {}),
+}
+
+
+@pytest.fixture(scope="module")
+def engine():
+    df = make_sales_dataset(100_000, days=730, seed=1)
+    # Sorted by region, so a region filter leaves some shards empty
+    df = df.sort_values("Region", kind="stable").reset_index(drop=True)
+
+    rng = np.random.default_rng(1)
+    df["Discount"] = rng.random(len(df)) * 1e6
+    df.loc[rng.random(len(df)) < 0.1, "Discount"] = np.nan
+    df["Returns"] = pd.array(rng.integers(0, 5, len(df)), dtype="Int64")
+    df.loc[rng.random(len(df)) < 0.1, "Returns"] = pd.NA
+    return SmartAnalyticsEngine(df)
+
+
+def make_parsed(aggregation, metric, filters):
+    column_filters, time_filter = FILTERS[filters]
+    return {
+        "aggregation": aggregation,
+        "metric": metric,
+        "filters": column_filters,
+        "time_filter": time_filter,
+    }
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("metric", ["Sales", "Quantity", "Discount", "Returns"])
+@pytest.mark.parametrize("aggregation", AGGREGATIONS)
+def test_parallel_matches_serial(engine, aggregation, metric, filters):
+    parsed = make_parsed(aggregation, metric, filters)
+
+    serial = engine.execute_query(parsed)
+    parallel = engine.execute_query(parsed, workers=4)
+
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+@pytest.mark.parametrize("aggregation", AGGREGATIONS)
+def test_more_workers_than_rows(aggregation):
+    engine = SmartAnalyticsEngine(make_sales_dataset(3))
+    parsed = make_parsed(aggregation, "Sales", "none")
+
+    pd.testing.assert_frame_equal(engine.execute_query(parsed, workers=8), engine.execute_query(parsed))
+
+
+def test_nullable_int_sum_stays_integer():
+    df = pd.DataFrame({
+        "Region": ["East", "East", "West", "West"],
+        "Units": pd.array([10, None, 15, None], dtype="Int64"),
+    })
+    engine = SmartAnalyticsEngine(df)
+    parsed = make_parsed("sum", "Units", "none")
+
+    for workers in (None, 2):
+        value = engine.execute_query(parsed, workers=workers).iloc[0, 0]
+        assert value == 25
+        assert isinstance(value, np.integer)
+
+
+@pytest.mark.parametrize("workers", [2, 3, 5, 16])
+def test_float_sum_does_not_depend_on_workers(engine, workers):
+    parsed = make_parsed("mean", "Discount", "none")
+    pd.testing.assert_frame_equal(engine.execute_query(parsed, workers=workers), engine.execute_query(parsed))
+
+
+def test_empty_frame_runs_serially():
+    engine = SmartAnalyticsEngine(make_sales_dataset(0))
+    parsed = make_parsed("sum", "Sales", "none")
+
+    pd.testing.assert_frame_equal(engine.execute_query(parsed, workers=2), engine.execute_query(parsed))
+
+
+def test_broken_pool_is_replaced(engine):
+    import os
+    import signal
+
+    import parallel
+
+    parsed = make_parsed("sum", "Sales", "region")
+    expected = engine.execute_query(parsed)
+    pd.testing.assert_frame_equal(engine.execute_query(parsed, workers=2), expected)
+
+    # Kill the workers, as the OOM killer would
+    pool = parallel._get_pool(2)
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    for _ in range(2):
+        pd.testing.assert_frame_equal(engine.execute_query(parsed, workers=2), expected)
+    assert parallel._get_pool(2) is not pool
+
+
+def test_filter_codes_use_the_smallest_int_type(engine):
+    engine.execute_query(make_parsed("sum", "Sales", "region"), workers=2)
+    (_, dtype, _), uniques = engine._shared_frame.codes("Region")
+
+    assert len(uniques) == 4
+    assert np.dtype(dtype) == np.int8
@@ -0,0 +1,156 @@
+import pandas as pd
+import pytest
+
+from benchmark import make_sales_dataset
+from engine import SmartAnalyticsEngine
+from result_cache import ResultCache, cached_query, canonical_query
+from service import DatasetPool
+
+
+def frame(rows):
+    return pd.DataFrame({"value": range(rows)})
+
+
+def size_of(result):
+    return int(result.memory_usage(index=True, deep=True).sum())
+
+
+def parsed_query(filters, time_filter=None):
+    return {
+        "aggregation": "sum",
+        "metric": "Sales",
+        "filters": [{"column": c, "value": v} for c, v in filters],
+        "time_filter": time_filter or {},
+    }
+
+
+# -----------------------------
+# CANONICAL QUERY
+# -----------------------------
+def test_canonical_query_ignores_filter_order():
+    a = parsed_query([("Region", "East"), ("Product", "A")], {"year": 2022, "month": 3})
+    b = parsed_query([("Product", "A"), ("Region", "East")], {"month": 3, "year": 2022})
+    assert canonical_query(a) == canonical_query(b)
+
+
+def test_canonical_query_distinguishes_values_and_fractions():
+    east = parsed_query([("Region", "East")])
+    assert canonical_query(east) != canonical_query(parsed_query([("Region", "West")]))
+    # 1 and "1" are different filter values
+    assert canonical_query(parsed_query([("Store", 1)])) != canonical_query(parsed_query([("Store", "1")]))
+    assert canonical_query(east) != canonical_query(east, sample_fraction=0.01)
+
+
+# -----------------------------
+# RESULT CACHE
+# -----------------------------
+def test_get_returns_a_copy():
+    cache = ResultCache()
+    cache.put("key", frame(3))
+
+    cache.get("key")["value"] = -1
+    assert cache.get("key")["value"].tolist() == [0, 1, 2]
+
+
+def test_bytes_accounting():
+    cache = ResultCache()
+    cache.put("a", frame(10))
+    cache.put("b", frame(20))
+    assert cache.stats()["bytes"] == size_of(frame(10)) + size_of(frame(20))
+
+    # Replacing an entry doesn't count it twice
+    cache.put("a", frame(30))
+    assert cache.stats()["bytes"] == size_of(frame(30)) + size_of(frame(20))
+    assert cache.stats()["entries"] == 2
+
+    cache.clear()
+    assert cache.stats()["bytes"] == 0 and cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used_by_size():
+    entry = size_of(frame(100))
+    cache = ResultCache(max_bytes=entry * 2)
+    cache.put("a", frame(100))
+    cache.put("b", frame(100))
+    cache.get("a")  # b is now the least recently used
+
+    cache.put("c", frame(100))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_result_larger_than_the_cache_is_not_stored():
+    cache = ResultCache(max_bytes=size_of(frame(10)))
+    cache.put("small", frame(10))
+    cache.put("big", frame(1_000))
+
+    assert cache.get("big") is None
+    assert cache.get("small") is not None
+
+
+def test_invalidate_drops_one_dataset():
+    cache = ResultCache()
+    cache.put(("old", "q1"), frame(1))
+    cache.put(("old", "q2"), frame(1))
+    cache.put(("other", "q1"), frame(1))
+
+    cache.invalidate("old")
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["invalidations"] == 2
+    assert stats["bytes"] == size_of(frame(1))
+    assert cache.get(("other", "q1")) is not None
+
+
+def test_hit_rate():
+    cache = ResultCache()
+    assert cache.stats()["hit_rate"] is None
+
+    cache.get("a")
+    cache.put("a", frame(1))
+    cache.get("a")
+    cache.get("a")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+
+# -----------------------------
+# CACHED QUERY
+# -----------------------------
+def test_cached_query_shares_results_between_phrasings():
+    engine = SmartAnalyticsEngine(make_sales_dataset(1_000))
+    cache = ResultCache()
+
+    first = cached_query(engine, engine.parse_question("total Sales for East in march 2022"), cache)
+    second = cached_query(engine, engine.parse_question("sum of Sales in march 2022 for East"), cache)
+
+    pd.testing.assert_frame_equal(first, second)
+    assert cache.stats()["hits"] == 1
+
+
+def test_version_token_replaces_the_content_hash():
+    df = make_sales_dataset(100)
+    engine = SmartAnalyticsEngine(df, version="v1")
+
+    assert engine.fingerprint() == "version:v1"
+    assert SmartAnalyticsEngine(df).fingerprint() == SmartAnalyticsEngine(df.copy()).fingerprint()
+
+
+def test_reregistering_a_deleted_file_drops_its_results(tmp_path):
+    path = tmp_path / "sales.csv"
+    sales = make_sales_dataset(1_000)
+    sales.to_csv(path, index=False)
+    cache = ResultCache()
+    pool = DatasetPool(cache)
+    pool.register_path("sales", str(path), out_of_core=True)
+
+    engine = pool.get("sales")
+    cached_query(engine, engine.parse_question("total Sales"), cache)
+    path.unlink()
+
+    # The old engine's fingerprint was recorded at scan time, no stat needed
+    pool.register("sales", sales)
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
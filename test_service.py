@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmark import make_sales_dataset
+from service import DatasetPool, QueryService, ServiceError, make_handler
+
+
+@pytest.fixture
+def sales_csv(tmp_path):
+    path = tmp_path / "sales.csv"
+    make_sales_dataset(2_000, seed=6).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def service(sales_csv):
+    service = QueryService(workers=2, max_pending=2, data_dir=str(sales_csv.parent))
+    service.pool.register_path("sales", str(sales_csv))
+    yield service
+    service.executor.shutdown()
+
+
+def block_queries(service, name="sales"):
+    """Make queries on ``name`` wait until the returned event is set."""
+    release = threading.Event()
+    engine = service.pool.get(name)
+    execute_query = engine.execute_query
+
+    def blocked(*args, **kwargs):
+        release.wait(10)
+        return execute_query(*args, **kwargs)
+
+    engine.execute_query = blocked
+    return release
+
+
+def wait_for_pending(service, n):
+    for _ in range(500):
+        if service.stats()["pending"] == n:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"pending never reached {n}")
+
+
+# -----------------------------
+# QUERY SERVICE
+# -----------------------------
+def test_query_and_batch(service):
+    single = service.run_query("sales", "total Sales for East")
+    batch = service.run_batch("sales", ["total Sales for East", "count Sales"])
+
+    assert single["parsed"]["aggregation"] == "sum"
+    assert batch[0] == single
+    assert batch[1]["result"] == [{"count_Sales": 2_000}]
+
+
+def test_unknown_dataset_is_404(service):
+    with pytest.raises(ServiceError) as e:
+        service.run_query("nope", "total Sales")
+    assert e.value.status == 404
+
+
+def test_busy_service_answers_503(service):
+    release = block_queries(service)
+    worker = threading.Thread(
+        target=service.run_batch, args=("sales", ["total Sales", "count Sales"])
+    )
+    worker.start()
+    try:
+        wait_for_pending(service, 2)
+        with pytest.raises(ServiceError) as e:
+            service.run_query("sales", "max Sales")
+        assert e.value.status == 503
+    finally:
+        release.set()
+        worker.join()
+    assert service.stats()["pending"] == 0
+
+
+@pytest.mark.parametrize("questions, sample_fraction, status", [
+    (["total Sales"] * 3, None, 413),
+    ("total Sales", None, 400),
+    ([1, 2], None, 400),
+    (["total Sales"], "0.1", 400),
+    (["total Sales"], 0, 400),
+    (["total Sales"], 1.5, 400),
+    (["total Sales"], True, 400),
+])
+def test_invalid_batches(service, questions, sample_fraction, status):
+    with pytest.raises(ServiceError) as e:
+        service.run_batch("sales", questions, sample_fraction)
+    assert e.value.status == status
+    assert service.stats()["pending"] == 0
+
+
+def test_sample_fraction_returns_estimate(service):
+    result = service.run_query("sales", "total Sales", sample_fraction=0.1)["result"][0]
+    assert result["label"] == "10% sample estimate"
+
+
+# -----------------------------
+# DATASET POOL
+# -----------------------------
+def test_paths_are_confined_to_data_dir(sales_csv, tmp_path):
+    pool = DatasetPool(data_dir=str(tmp_path))
+    (tmp_path / "link").symlink_to("/etc")
+
+    assert pool.resolve_path("sales.csv") == str(sales_csv.resolve())
+    for path in ("/etc/passwd", "../sales.csv", "link/passwd"):
+        with pytest.raises(ServiceError) as e:
+            pool.resolve_path(path)
+        assert e.value.status == 403
+
+
+def test_registry_syncs_across_pools(sales_csv, tmp_path):
+    registry = str(tmp_path / "datasets.json")
+    first = DatasetPool(registry_path=registry)
+    second = DatasetPool(registry_path=registry)
+
+    first.register_path("sales", str(sales_csv))
+    assert second.names() == ["sales"]
+    assert second.get("sales").rows == 2_000
+
+    # Re-registering reloads the dataset in the other pool too
+    make_sales_dataset(50).to_csv(sales_csv, index=False)
+    first.register_path("sales", str(sales_csv))
+    assert second.get("sales").rows == 50
+
+
+def test_registry_entry_that_fails_to_load_is_isolated(sales_csv, tmp_path):
+    registry = str(tmp_path / "datasets.json")
+    other_csv = tmp_path / "other.csv"
+    make_sales_dataset(10).to_csv(other_csv, index=False)
+
+    first = DatasetPool(registry_path=registry)
+    second = DatasetPool(registry_path=registry)
+    first.register_path("sales", str(sales_csv))
+    first.register_path("other", str(other_csv))
+    sales_csv.unlink()
+
+    assert second.names() == ["other"]
+    assert second.get("other").rows == 10
+    for _ in range(2):
+        with pytest.raises(ServiceError) as e:
+            second.get("sales")
+        assert e.value.status == 500
+
+
+# -----------------------------
+# HTTP LAYER
+# -----------------------------
+@pytest.fixture
+def server(service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def call(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read()), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read()), e.headers
+
+
+def test_http_routes(server, sales_csv):
+    status, health, _ = call(f"{server}/health")
+    assert status == 200 and health["datasets"] == ["sales"]
+
+    status, body, _ = call(f"{server}/query", {"dataset": "sales", "question": "count Sales"})
+    assert status == 200 and body["result"] == [{"count_Sales": 2_000}]
+
+    status, body, _ = call(f"{server}/datasets", {"name": "copy", "path": sales_csv.name})
+    assert status == 200 and body["rows"] == 2_000
+
+    assert call(f"{server}/datasets", {"name": "passwd", "path": "/etc/passwd"})[0] == 403
+    assert call(f"{server}/query", {"dataset": "sales"})[0] == 400
+    assert call(f"{server}/nope")[0] == 404
+
+
+def test_http_batch_errors(server):
+    status, _, headers = call(f"{server}/batch", {"dataset": "sales", "questions": ["count Sales"] * 3})
+    assert status == 413 and headers.get("Retry-After") is None
+
+    body = {"dataset": "sales", "question": "count Sales", "sample_fraction": "0.1"}
+    assert call(f"{server}/query", body)[0] == 400
+
+
+def test_http_busy_sets_retry_after(server, service):
+    release = block_queries(service)
+    worker = threading.Thread(
+        target=call, args=(f"{server}/batch", {"dataset": "sales", "questions": ["count Sales"] * 2})
+    )
+    worker.start()
+    try:
+        wait_for_pending(service, 2)
+        status, _, headers = call(f"{server}/query", {"dataset": "sales", "question": "max Sales"})
+        assert status == 503 and headers["Retry-After"] == "1"
+    finally:
+        release.set()
+        worker.join()
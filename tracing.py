@@ -0,0 +1,140 @@
+"""
+Lightweight per-request tracing.
+
+A QueryTrace collects the wall time (and, with memory tracking on, the
+change in traced memory) of each named stage of a request, plus LLM
+metrics. Code under trace marks its stages with ``stage()``; when no trace
+is active ``stage()`` does nothing, so the engine can be instrumented
+unconditionally.
+
+tracemalloc is process-wide and slows every allocation, so memory tracking
+is a process setting: start the process with TRACE_MEMORY=1 to turn it on.
+Only traces of a question or an LLM call are appended to the trace log.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "query_traces.jsonl")
+TRACE_MEMORY = os.getenv("TRACE_MEMORY", "").lower() in ("1", "true", "yes")
+
+if TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+_log_lock = threading.Lock()
+
+
+class QueryTrace:
+
+    def __init__(self, **meta):
+        self.trace_id = uuid.uuid4().hex
+        self.meta = meta
+        self.started_at = time.time()
+        self.total_seconds = None
+        self.stages = []
+        self.llm = {}
+
+        self._start = time.perf_counter()
+        self._token = None
+
+    # -----------------------------
+    # ACTIVATION
+    # -----------------------------
+    def activate(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def finish(self, log_path=TRACE_LOG_PATH):
+        self.total_seconds = time.perf_counter() - self._start
+
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+
+        if log_path and (self.meta.get("question") or self.llm):
+            append_trace(self, log_path)
+
+        return self
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.meta["error"] = repr(exc)
+        self.finish()
+        return False
+
+    # -----------------------------
+    # EXPORT
+    # -----------------------------
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "total_seconds": self.total_seconds,
+            **self.meta,
+            "stages": self.stages,
+            "llm": self.llm,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def start_trace(**meta):
+    """Create and activate a trace for code that can't use a with-block."""
+    return QueryTrace(**meta).activate()
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Time the enclosed block as stage ``name`` of the active trace.
+
+    Yields a dict the caller may add details to (e.g. row counts).
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield info
+        return
+
+    # The peak can't be reset per stage without clobbering concurrent
+    # requests, so record the net change in traced memory instead
+    tracing_memory = tracemalloc.is_tracing()
+    if tracing_memory:
+        start_mem, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record = {"stage": name, "seconds": time.perf_counter() - start}
+
+        if tracing_memory:
+            end_mem, _ = tracemalloc.get_traced_memory()
+            record["memory_delta_mb"] = (end_mem - start_mem) / 2**20
+
+        record.update(info)
+        trace.stages.append(record)
+
+
+def record_llm(**fields):
+    """Attach LLM metrics (tokens, time to first token...) to the active trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.llm.update(fields)
+
+
+def append_trace(trace, log_path=TRACE_LOG_PATH):
+    line = json.dumps(trace.to_dict(), default=str)
+    with _log_lock:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")